@@ -11,6 +11,7 @@ What this app does
    - servers.csv (flattened metadata, with 3 topic columns)
    - server_yearly_trends.csv (years as columns; rows are metrics)
    - server_monthly_trends.csv (optional and slower; placeholder if disabled)
+   - the same three tables as .parquet files (smaller, faster to load downstream)
    - json/ folder with raw source JSON + 1 sample Work JSON per previewed server
      (filenames include display name + sid for easy recognition)
 
@@ -30,16 +31,46 @@ Notes
 
 import io
 import json
+import operator
 import re
+import shutil
+import tempfile
+import threading
 import time
 import zipfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, List, Optional, Any, Set, Tuple
+from typing import IO, Dict, Iterator, List, Optional, Any, Set, Tuple
 from urllib.parse import quote
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 import requests
 import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# orjson is much faster at encoding large Source records; fall back to stdlib json.
+try:
+    import orjson
+
+    def _dumps_bytes(obj: Any, indent: bool = False) -> bytes:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, option=option)
+
+    _loads = orjson.loads
+except ImportError:
+    def _dumps_bytes(obj: Any, indent: bool = False) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None).encode("utf-8")
+
+    _loads = json.loads
+
+def _dumps(obj: Any) -> str:
+    return _dumps_bytes(obj).decode("utf-8")
 
 # ──────────────────────────────────────────────────────────────────────────────
 # App config & constants
@@ -50,19 +81,31 @@ st.set_page_config(
     layout="wide",
 )
 OPENALEX_BASE = "https://api.openalex.org"
+FETCH_WORKERS = 8  # concurrent Source fetches during a build
+ZIP_SPOOL_MAX = 64 * 1024 * 1024  # build the ZIP in memory up to 64 MB, then spill to disk
+ZIP_WRITE_BUFFER = 1024 * 1024    # one shared 1 MiB write buffer once spilled
+ZIP_CHUNK = 64 * 1024             # chunk size when streaming blobs into ZIP entries
+_EMPTY: Dict[str, Any] = {}  # shared read-only default for .get() chains; never mutate
+LOG_FLUSH_EVERY = 20  # re-render the resolve log box at most once per this many lines
+UI_MIN_INTERVAL_S = 0.05  # cap build-progress widget refreshes at ~20 Hz
+# Placeholder written as server_monthly_trends.csv when monthly aggregation is off
+# (quoted exactly as encode_csv / pyarrow writes the other CSVs)
+_MONTHLY_DISABLED_CSV = (
+    b'"source_id","display_name","metric","note"\n'
+    b'"","","info","Monthly aggregation disabled in app."\n'
+)
 
 # ──────────────────────────────────────────────────────────────────────────────
 # THEME: runtime Light/Dark/Auto + Accent color
 # ──────────────────────────────────────────────────────────────────────────────
-def apply_runtime_theme(mode: str, accent: str):
-    """Apply a simple runtime theme using CSS variables."""
-    is_dark = (mode == "Dark") or (mode == "Auto" and st.get_option("theme.base") == "dark")
+@st.cache_resource(show_spinner=False)
+def _build_css(is_dark: bool, accent: str) -> str:
+    """Render the theme <style> block once per (dark/light, accent) pair."""
     bg = "#0E1117" if is_dark else "#FFFFFF"
     text = "#FAFAFA" if is_dark else "#111111"
     subtle = "#161b22" if is_dark else "#f6f8fa"
 
-    st.markdown(
-        f"""
+    return f"""
         <style>
         :root {{
           --acc: {accent};
@@ -81,36 +124,69 @@ def apply_runtime_theme(mode: str, accent: str):
         .stExpander > div > div {{ border-bottom: 1px solid var(--acc); }}
         .stMetric label, .stMetric small {{ color: var(--text) !important; }}
         </style>
-        """,
-        unsafe_allow_html=True,
-    )
+        """
+
+def apply_runtime_theme(mode: str, accent: str):
+    """Apply a simple runtime theme using CSS variables."""
+    is_dark = (mode == "Dark") or (mode == "Auto" and st.get_option("theme.base") == "dark")
+    st.markdown(_build_css(is_dark, accent), unsafe_allow_html=True)
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Small utilities (HTTP + text)
 # ──────────────────────────────────────────────────────────────────────────────
-def api_get(url: str, sleep_s: float, max_retries: int = 5, mailto: Optional[str] = None) -> requests.Response:
-    """GET with polite retry/backoff. Adds mailto param (recommended by OpenAlex)."""
-    headers = {"User-Agent": "OpenAlexStreamlitBatch/1.1"}
+@st.cache_resource(show_spinner=False)
+def make_session() -> requests.Session:
+    """
+    Shared HTTP session: keep-alive connection pool (reused TLS connections)
+    plus urllib3 retry/backoff on rate limits and transient server errors.
+    Cached as a resource so the pool survives Streamlit reruns.
+    """
+    session = requests.Session()
+    session.headers.update({"User-Agent": "OpenAlexStreamlitBatch/1.1"})
+    retry = Retry(
+        total=5,
+        backoff_factor=0.6,
+        status_forcelist=(429, 500, 502, 503, 504),
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+SESSION = make_session()
+
+class RateLimiter:
+    """Thread-safe spacing of request start times, shared by all fetch threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._next_t = 0.0
+
+    def acquire(self, sleep_s: float):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_t)
+            self._next_t = start + sleep_s
+        if start > now:
+            time.sleep(start - now)
+
+RATE_LIMITER = RateLimiter()
+
+def api_get(url: str, sleep_s: float, mailto: Optional[str] = None) -> Dict[str, Any]:
+    """Polite GET (retries handled by SESSION) returning the parsed JSON body. Adds mailto param (recommended by OpenAlex)."""
     if mailto:
         url += ("&" if "?" in url else "?") + f"mailto={quote(mailto)}"
-    backoff = sleep_s
-    for _ in range(max_retries):
-        r = requests.get(url, headers=headers, timeout=60)
-        if r.status_code == 200:
-            if sleep_s > 0:
-                time.sleep(sleep_s)  # be polite to the API
-            return r
-        if r.status_code in (429, 500, 502, 503, 504):
-            time.sleep(backoff)
-            backoff *= 1.6
-            continue
-        r.raise_for_status()
+    RATE_LIMITER.acquire(sleep_s)  # be polite to the API, across threads too
+    r = SESSION.get(url, timeout=60)
     r.raise_for_status()
-    return r
+    return _loads(r.content)
+
+_WS_RE = re.compile(r"\s+")
 
 def norm_name(s: str) -> str:
     """Normalize whitespace for consistent matching."""
-    return " ".join((s or "").strip().split())
+    return _WS_RE.sub(" ", (s or "").strip())
 
 def safe_slug(s: str) -> str:
     """
@@ -130,6 +206,7 @@ def safe_slug(s: str) -> str:
 def read_csv_safely(uploaded_file) -> Tuple[pd.DataFrame, str]:
     """
     Try several encodings in order. Return (DataFrame, encoding_used).
+    Only the first column is parsed, as plain strings (literal "NA" stays a name).
     Raises ValueError if all attempts fail.
     """
     # Read the raw bytes once
@@ -139,7 +216,7 @@ def read_csv_safely(uploaded_file) -> Tuple[pd.DataFrame, str]:
     for enc in attempts:
         try:
             buf = io.BytesIO(raw)
-            df = pd.read_csv(buf, encoding=enc)
+            df = pd.read_csv(buf, encoding=enc, usecols=[0], dtype=str, engine="c", keep_default_na=False)
             return df, enc
         except Exception as e:
             last_err = e
@@ -152,24 +229,42 @@ def read_csv_safely(uploaded_file) -> Tuple[pd.DataFrame, str]:
 # ──────────────────────────────────────────────────────────────────────────────
 # OpenAlex: resolving & fetching
 # ──────────────────────────────────────────────────────────────────────────────
+@st.cache_data(ttl=3600, show_spinner=False)
 def resolve_candidates(name: str, per_page: int, sleep_s: float, mailto: Optional[str]) -> List[Dict[str, Any]]:
-    """Resolve a human-entered server name to OpenAlex Source candidates."""
+    """Resolve a human-entered server name to OpenAlex Source candidates (cached for an hour across reruns)."""
     q = quote(name)
     url = f"{OPENALEX_BASE}/sources?filter=display_name.search:%22{q}%22&per-page={per_page}"
-    r = api_get(url, sleep_s=sleep_s, mailto=mailto)
-    results = r.json().get("results", [])
+    results = api_get(url, sleep_s=sleep_s, mailto=mailto).get("results", [])
     if not results:
         url = f"{OPENALEX_BASE}/sources?search={q}&per-page={per_page}"
-        r = api_get(url, sleep_s=sleep_s, mailto=mailto)
-        results = r.json().get("results", [])
+        results = api_get(url, sleep_s=sleep_s, mailto=mailto).get("results", [])
     for c in results:
         c["short_id"] = (c.get("id") or "").replace("https://openalex.org/", "")
     return results
 
+@st.cache_data(ttl=3600, show_spinner=False)
 def fetch_source(sid: str, sleep_s: float, mailto: Optional[str]) -> Dict[str, Any]:
-    """Fetch a full Source record from OpenAlex."""
+    """Fetch a full Source record from OpenAlex (cached for an hour across reruns)."""
     url = f"{OPENALEX_BASE}/sources/{sid}"
-    return api_get(url, sleep_s=sleep_s, mailto=mailto).json()
+    return api_get(url, sleep_s=sleep_s, mailto=mailto)
+
+def prefetch_sources(
+    sids: List[str],
+    sleep_s: float,
+    mailto: Optional[str],
+    workers: int = FETCH_WORKERS,
+) -> Iterator[Tuple[str, "Future[Dict[str, Any]]"]]:
+    """
+    Start fetching all Sources on a thread pool and yield (sid, future) in input order.
+    Requests overlap in flight while RATE_LIMITER keeps them politely spaced.
+    Closing the generator early (error or stop) cancels fetches that have not started yet.
+    """
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = [pool.submit(fetch_source, sid, sleep_s, mailto) for sid in sids]
+        yield from zip(sids, futures)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
 
 def iter_works_for_source(
     sid: str,
@@ -181,7 +276,11 @@ def iter_works_for_source(
     use_primary_location: bool = True,
     use_host_venue: bool = False,
 ):
-    """Iterate works for a given Source. Used only for monthly aggregation."""
+    """
+    Iterate pages of works (lists of dicts) for a given Source. Used only for monthly aggregation.
+    Note: OpenAlex `group_by` can only bucket counts by publication_year and cannot sum
+    cited_by_count, so monthly works/citation totals still need this (minimal-select) scan.
+    """
     filters = []
     if use_primary_location:
         filters.append(f"primary_location.source.id:{sid}")
@@ -193,22 +292,17 @@ def iter_works_for_source(
         filters.append(f"to_publication_date:{date_to}")
     filter_str = ",".join(filters)
 
-    base_url = f"{OPENALEX_BASE}/works?per-page=200&cursor=*"
+    base_url = f"{OPENALEX_BASE}/works?per-page=200"
     if filter_str:
         base_url += f"&filter={quote(filter_str)}"
     if select_fields:
         base_url += f"&select={quote(select_fields)}"
 
-    next_url = base_url
-    while True:
-        r = api_get(next_url, sleep_s=sleep_s, mailto=mailto)
-        data = r.json()
-        for w in data.get("results", []):
-            yield {"publication_date": w.get("publication_date"), "cited_by_count": w.get("cited_by_count", 0)}
-        nxt = data.get("meta", {}).get("next_cursor")
-        if not nxt:
-            break
-        next_url = base_url.replace("cursor=*", f"cursor={quote(nxt)}")
+    cursor = "*"  # first page; OpenAlex returns next_cursor=None on the last one
+    while cursor:
+        data = api_get(f"{base_url}&cursor={quote(cursor, safe='*')}", sleep_s=sleep_s, mailto=mailto)
+        yield data.get("results", [])
+        cursor = data.get("meta", _EMPTY).get("next_cursor")
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Flattening + topic columns
@@ -218,7 +312,7 @@ def _stringify(x: Any) -> str:
         return ""
     if isinstance(x, (str, int, float, bool)):
         return str(x)
-    return json.dumps(x, ensure_ascii=False)
+    return _dumps(x)
 
 def flatten_json(obj: Any, prefix: str = "", out: Optional[Dict[str, str]] = None) -> Dict[str, str]:
     """Flatten nested JSON into a 1-level dict of string columns."""
@@ -227,12 +321,19 @@ def flatten_json(obj: Any, prefix: str = "", out: Optional[Dict[str, str]] = Non
     if isinstance(obj, dict):
         for k, v in obj.items():
             key = f"{prefix}__{k}" if prefix else k
-            if isinstance(v, dict):
+            # Scalar leaves are by far the most common: handle them inline first
+            if v is None:
+                out[key] = ""
+            elif isinstance(v, (str, int, float, bool)):
+                out[key] = str(v)
+            elif isinstance(v, dict):
                 flatten_json(v, key, out)
             elif isinstance(v, list):
                 if all(isinstance(el, dict) for el in v):
                     for i, el in enumerate(v):
                         flatten_json(el, f"{key}_{i}", out)
+                elif all(isinstance(el, (str, int, float, bool)) for el in v):
+                    out[key] = "|".join(map(str, v))  # e.g. issn, alternate_titles
                 else:
                     out[key] = "|".join(_stringify(el) for el in v)
             else:
@@ -264,29 +365,67 @@ def build_topics_columns(topics: Any):
         t_count = t.get("count", "")
         if t_name:
             disp_list.append(f"{t_name} ({t_count})" if t_count != "" else t_name)
-        sf_name = (t.get("subfield") or {}).get("display_name", "")
+        sf_name = (t.get("subfield") or _EMPTY).get("display_name", "")
         if sf_name:
             sub_list.append(sf_name)
-        dom_name = (t.get("domain") or {}).get("display_name", "")
+        dom_name = (t.get("domain") or _EMPTY).get("display_name", "")
         if dom_name:
             dom_list.append(dom_name)
     return "; ".join(disp_list), "; ".join(sub_list), "; ".join(dom_list)
 
-def iso_to_year_month(iso_date: str) -> Optional[str]:
-    """Normalize dates to YYYY-MM for monthly bins."""
-    if not iso_date:
-        return None
-    try:
-        dt = datetime.fromisoformat(iso_date)
-        return f"{dt.year:04d}-{dt.month:02d}"
-    except Exception:
-        parts = str(iso_date).split("-")
-        if len(parts) == 2:
-            y, m = parts
-            return f"{int(y):04d}-{int(m):02d}"
-        if len(parts) == 1 and parts[0].isdigit():
-            return f"{int(parts[0]):04d}-01"
-    return None
+TREND_METRICS = ("works_count", "cited_by_count")
+
+def wide_trends(records: List[Tuple[str, str, str, int]], sid_to_name: Dict[str, str]) -> pd.DataFrame:
+    """
+    Turn long (source_id, metric, period, value) records into a wide table:
+    one row per (source, metric), periods (years or YYYY-MM) as sorted columns.
+    Sources keep their first-seen order; metrics follow TREND_METRICS.
+    Values are summed into a C-contiguous int64 matrix addressed by integer codes.
+    """
+    id_cols = ["source_id", "display_name", "metric"]
+    if not records:
+        return pd.DataFrame(columns=id_cols)
+    sids, metrics, periods, values = zip(*records)
+    sid_codes, sid_uniques = pd.factorize(pd.Index(sids))
+    period_codes, period_uniques = pd.factorize(pd.Index(periods), sort=True)
+    metric_idx = {m: k for k, m in enumerate(TREND_METRICS)}
+    metric_codes = np.fromiter((metric_idx[m] for m in metrics), dtype=np.intp, count=len(records))
+
+    n_metrics = len(TREND_METRICS)
+    arr = np.zeros((len(sid_uniques) * n_metrics, len(period_uniques)), dtype=np.int64)
+    np.add.at(arr, (sid_codes * n_metrics + metric_codes, period_codes), np.asarray(values, dtype=np.int64))
+
+    row_sids = np.repeat(np.asarray(sid_uniques, dtype=object), n_metrics)
+    ids = pd.DataFrame({
+        "source_id": row_sids,
+        "display_name": [sid_to_name.get(sid, "") for sid in row_sids],
+        "metric": list(TREND_METRICS) * len(sid_uniques),
+    })
+    return pd.concat([ids, pd.DataFrame(arr, columns=list(period_uniques))], axis=1)
+
+@st.cache_resource(show_spinner=False)
+def monthly_disabled_preview() -> pd.DataFrame:
+    """Preview frame for the monthly placeholder, parsed once from _MONTHLY_DISABLED_CSV (read-only)."""
+    return pd.read_csv(io.BytesIO(_MONTHLY_DISABLED_CSV), dtype=str, keep_default_na=False)
+
+def monthly_counts_from_works(works: List[Dict[str, Any]]) -> pd.DataFrame:
+    """
+    Bucket works into YYYY-MM bins in one vectorized pass.
+    Returns a DataFrame indexed by YYYY-MM with works_count and cited_by_count.
+    Dates may be YYYY-MM-DD, YYYY-MM or YYYY (mapped to January); others are dropped.
+    """
+    df = pd.DataFrame(works, columns=["publication_date", "cited_by_count"])
+    dates = df["publication_date"].fillna("").astype(str)
+    valid = dates.str.match(r"\d{4}(?:-(?:0[1-9]|1[0-2])(?:-|$)|$)")  # month 01–12 when present
+    dates = dates[valid]
+    df = pd.DataFrame({
+        "ym": dates.str.slice(0, 7).where(dates.str.len() >= 7, dates.str.slice(0, 4) + "-01"),
+        "cited_by_count": pd.to_numeric(df.loc[valid, "cited_by_count"], errors="coerce").fillna(0).astype("int64"),
+    })
+    return df.groupby("ym", sort=False).agg(
+        works_count=("ym", "size"),
+        cited_by_count=("cited_by_count", "sum"),
+    )
 
 # ──────────────────────────────────────────────────────────────────────────────
 # NEW: sample Work fetcher + JSON pretty printer
@@ -322,15 +461,45 @@ def fetch_sample_preprint_for_source(
         f"&filter={quote(filter_str)}"#&select={quote(select_fields)}"
     )
     try:
-        r = api_get(url, sleep_s=sleep_s, mailto=mailto)
-        items = r.json().get("results", [])
+        items = api_get(url, sleep_s=sleep_s, mailto=mailto).get("results", [])
         return items[0] if items else None
     except Exception:
         return None
 
+def encode_csv(df: pd.DataFrame) -> IO[bytes]:
+    """
+    Encode a DataFrame as UTF-8 CSV with pyarrow's C++ writer (GIL released) into a
+    spooled temp file, rewound and ready to copy. Safe to run on a worker thread.
+    """
+    out = tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_MAX)
+    pacsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), out, pacsv.WriteOptions(include_header=True))
+    out.seek(0)
+    return out
+
+def copy_file_to_zip(zf: zipfile.ZipFile, name: str, src: IO[bytes]):
+    """Copy an open binary file into a (compressed) ZIP entry in ZIP_CHUNK pieces, then close it."""
+    with src, zf.open(name, "w", force_zip64=True) as fh:
+        shutil.copyfileobj(src, fh, ZIP_CHUNK)
+
+def write_parquet_to_zip(zf: zipfile.ZipFile, name: str, df: pd.DataFrame, use_dictionary: Any = True):
+    """Write a DataFrame as a zstd Parquet entry; stored as-is since Parquet is already compressed."""
+    if isinstance(use_dictionary, (list, tuple)):
+        use_dictionary = [c for c in use_dictionary if c in df.columns] or False
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink, compression="zstd", compression_level=3, use_dictionary=use_dictionary)
+    zf.writestr(name, sink.getvalue().to_pybytes(), compress_type=zipfile.ZIP_STORED)
+
+def write_blob_to_zip(zf: zipfile.ZipFile, name: str, data: bytes):
+    """Stream an already-serialized blob into a ZIP entry in chunks (ZipFile's own compression)."""
+    view = memoryview(data)
+    with zf.open(name, "w", force_zip64=len(data) >= zipfile.ZIP64_LIMIT) as fh:
+        for i in range(0, len(view), ZIP_CHUNK):
+            fh.write(view[i:i + ZIP_CHUNK])
+
 def to_pretty_json_str(obj: Any) -> str:
     try:
-        return json.dumps(obj, ensure_ascii=False, indent=2)
+        return _dumps_bytes(obj, indent=True).decode("utf-8")
     except Exception:
         return json.dumps({"error": "unserializable"}, ensure_ascii=False, indent=2)
 
@@ -462,7 +631,7 @@ if uploaded_csv is not None:
             st.warning("Uploaded CSV appears to be empty.")
         else:
             first_col = df.columns[0]
-            names = [norm_name(x) for x in df[first_col].astype(str).tolist() if norm_name(x)]
+            names = [norm_name(x) for x in df[first_col].tolist() if norm_name(x)]
             st.caption(f"✅ CSV loaded using **{enc_used}** encoding.")
     except Exception as e:
         st.error(f"Failed to read CSV: {e}")
@@ -471,12 +640,7 @@ if manual_input.strip():
     names.extend([norm_name(x) for x in manual_input.splitlines() if norm_name(x)])
 
 # Deduplicate while preserving order
-seen = set()
-unique_names = []
-for n in names:
-    if n not in seen:
-        seen.add(n)
-        unique_names.append(n)
+unique_names = list(dict.fromkeys(names))
 
 st.subheader("1) Server names detected")
 if unique_names:
@@ -499,12 +663,13 @@ if "preview_samples" not in st.session_state:
     # Map sid -> {"source": <source_json>, "sample_work": <work_json or None>}
     st.session_state.preview_samples = {}
 
-def log_app(msg: str, box: st.delta_generator.DeltaGenerator):
-    """Append a timestamped line to the global log box."""
-    ts = datetime.now().strftime("%H:%M:%S")
+def log_app(msg: str, box: st.delta_generator.DeltaGenerator, flush: bool = True):
+    """Append a timestamped line to the global log; re-render the box only when `flush`."""
+    ts = time.strftime("%H:%M:%S")
     st.session_state.log_lines.append(f"[{ts}] {msg}")
     st.session_state.log_lines = st.session_state.log_lines[-400:]
-    box.code("\n".join(st.session_state.log_lines), language=None)
+    if flush:
+        box.code("\n".join(st.session_state.log_lines), language=None)
 
 st.markdown("### 2) Resolve your names to OpenAlex Sources")
 st.write(
@@ -520,12 +685,13 @@ if st.button("🔍 Resolve server names to OpenAlex Sources", key="btn_resolve",
     prog = st.progress(0)
     log_box = st.empty()
     for idx, name in enumerate(unique_names, start=1):
+        flush_log = idx % LOG_FLUSH_EVERY == 0 or idx == len(unique_names)
         try:
             cands = resolve_candidates(name, per_page=per_page, sleep_s=sleep_s, mailto=mailto or None)
-            log_app(f"Resolved '{name}' → {len(cands)} candidate(s).", log_box)
+            log_app(f"Resolved '{name}' → {len(cands)} candidate(s).", log_box, flush=flush_log)
         except Exception as e:
             st.warning(f"Resolution failed for '{name}': {e}")
-            log_app(f"Resolution failed for '{name}': {e}", log_box)
+            log_app(f"Resolution failed for '{name}': {e}", log_box, flush=flush_log)
             cands = []
         st.session_state.candidates_map[name] = cands
         st.session_state.selections_map[name] = []  # clear selections
@@ -634,8 +800,7 @@ selected_sids_all = []
 for nm, sids in st.session_state.selections_map.items():
     selected_sids_all.extend(sids)
 # de-dup while preserving order
-tmp_seen = set()
-selected_sids_all = [s for s in selected_sids_all if s and not (s in tmp_seen or tmp_seen.add(s))]
+selected_sids_all = list(dict.fromkeys(filter(None, selected_sids_all)))
 
 st.markdown("### 2b) Quick raw JSON previews (optional)")
 st.write("Pick a server to preview its raw JSON. These panels stay hidden until opened.")
@@ -667,11 +832,11 @@ else:
                 "sample_work": work_json
             }
 
-        preview = st.session_state.preview_samples.get(sid_choice, {})
+        preview = st.session_state.preview_samples.get(sid_choice, _EMPTY)
         src_json = preview.get("source")
         work_json = preview.get("sample_work")
 
-        disp_name = (src_json or {}).get("display_name", "")
+        disp_name = (src_json or _EMPTY).get("display_name", "")
         title_text = f"{disp_name} — {sid_choice}" if disp_name else sid_choice
         display_slug = safe_slug(disp_name) if disp_name else "unknown"
 
@@ -730,24 +895,23 @@ def build_zip_from_selection(
     chosen_sids: List[str] = []
     for lst in selections_map.values():
         chosen_sids.extend(lst)
-    seen = set()
-    chosen_sids = [x for x in chosen_sids if x and not (x in seen or seen.add(x))]
+    chosen_sids = list(dict.fromkeys(filter(None, chosen_sids)))
     if not chosen_sids:
         raise ValueError("No sources selected.")
 
     total = len(chosen_sids)
-    start_t = time.time()
-    per_server_times: List[float] = []
+    _now = time.monotonic  # local alias: read on every progress update; immune to clock changes
+    start_t = _now()
+    time_total = 0.0  # running sum of per-server times (avg = time_total / done)
     done = 0
 
     # Data accumulators
     servers_rows: List[Dict[str, str]] = []
     all_columns: Set[str] = set()
-    yearly_data: Dict[str, Dict[str, Dict[str, int]]] = {}
-    monthly_data: Dict[str, Dict[str, Dict[str, int]]] = {}
+    year_records: List[Tuple[str, str, str, int]] = []   # (sid, metric, YYYY, value)
+    month_records: List[Tuple[str, str, str, int]] = []  # (sid, metric, YYYY-MM, value)
     sid_to_name: Dict[str, str] = {}
-    years_seen: Set[str] = set()
-    months_seen: Set[str] = set()
+    raw_json_by_sid: Dict[str, bytes] = {}  # raw Source JSON, only written into the ZIP
 
     # Optional heavy UI (metrics row + per-server panels)
     if show_progress_details:
@@ -764,6 +928,7 @@ def build_zip_from_selection(
                 "progress": None,
                 "log": None,
                 "hist": [],
+                "pct": 0.0,
                 "title": sid
             }
         overall_prog = st.progress(0)
@@ -772,20 +937,23 @@ def build_zip_from_selection(
         panels = {}
         overall_prog = st.empty()
 
+    # The helpers below only record state and mark it dirty; refresh_ui() renders
+    # the newest state, throttled, since every widget write is a websocket delta.
+    dirty: Set[str] = set()         # "compact", "progress", "log"
+    dirty_panels: Set[str] = set()  # sids whose panel log/progress changed
+
     # Global log helper (always feeds the compact view; full log only if shown)
     def log_overall(msg: str):
-        ts = datetime.now().strftime("%H:%M:%S")
+        ts = time.strftime("%H:%M:%S")
         st.session_state.log_lines.append(f"[{ts}] {msg}")
         st.session_state.log_lines = st.session_state.log_lines[-400:]
-        # Only render into the big log box if visible
-        if show_progress_details:
-            overall_log.code("\n".join(st.session_state.log_lines), language=None)
+        dirty.add("log")
 
     # Per-server log helper (no-op when panels are hidden)
     def log_server(sid: str, msg: str):
         if not show_progress_details:
             return
-        ts = datetime.now().strftime("%H:%M:%S")
+        ts = time.strftime("%H:%M:%S")
         block = panels[sid]
         if block["log"] is None:
             with block["exp"]:
@@ -793,14 +961,14 @@ def build_zip_from_selection(
                 block["log"] = st.empty()
         block["hist"].append(f"[{ts}] {msg}")
         block["hist"] = block["hist"][-200:]
-        block["log"].code("\n".join(block["hist"]), language=None)
+        dirty_panels.add(sid)
 
     # Metrics helper
     def update_metrics():
         if not show_progress_details:
             return
-        elapsed = time.time() - start_t
-        avg = (sum(per_server_times) / len(per_server_times)) if per_server_times else 0.0
+        elapsed = _now() - start_t
+        avg = (time_total / done) if done else 0.0
         remaining = max(0.0, (total - done) * avg)
         rem = int(remaining)
         h, rem2 = divmod(rem, 3600)
@@ -811,37 +979,65 @@ def build_zip_from_selection(
         grid_cols[2].metric("ETA (approx)", eta_str)
 
     # Compact UI helpers
-    compact_lines: List[str] = []
+    compact_lines: deque = deque(maxlen=compact_log_keep)
     def push_compact(line: str):
         if compact_log is None:
             return
         compact_lines.append(line)
-        if len(compact_lines) > compact_log_keep:
-            compact_lines[:] = compact_lines[-compact_log_keep:]
-        compact_log.text("\n".join(compact_lines))
+        dirty.add("compact")
+
+    last_ui_t = 0.0
+    def refresh_ui(force: bool = False):
+        """Render pending updates at most every UI_MIN_INTERVAL_S (always when forced)."""
+        nonlocal last_ui_t
+        now = _now()
+        if not force and now - last_ui_t < UI_MIN_INTERVAL_S:
+            return
+        last_ui_t = now
+        if "compact" in dirty:
+            compact_log.text("\n".join(compact_lines))
+        if "progress" in dirty:
+            if compact_status is not None:
+                compact_status.text(f"Servers processed: {done}/{total}")
+            if compact_progress is not None:
+                compact_progress.progress(done / total)
+            if show_progress_details:
+                overall_prog.progress(done / total)
+            update_metrics()
+        # Only render into the big log box if visible
+        if "log" in dirty and show_progress_details:
+            overall_log.code("\n".join(st.session_state.log_lines), language=None)
+        for psid in dirty_panels:
+            block = panels[psid]
+            block["progress"].progress(block["pct"])
+            block["log"].code("\n".join(block["hist"]), language=None)
+        dirty.clear()
+        dirty_panels.clear()
 
     if compact_status is not None:
         compact_status.text(f"Servers processed: 0/{total}")
     if compact_progress is not None:
         compact_progress.progress(0)
 
-    # Main fetch/build loop
-    for sid in chosen_sids:
-        t0 = time.time()
+    # Main fetch/build loop (Source records are prefetched concurrently)
+    for sid, src_future in prefetch_sources(chosen_sids, sleep_s=sleep_s, mailto=mailto):
+        t0 = _now()
+        panel = panels.get(sid)  # None when progress details are hidden
 
         # Compact heartbeat
         push_compact(f"{done+1}/{total} — Fetching {sid}…")
 
         log_overall(f"Fetching source {sid}")
         log_server(sid, "Fetching source JSON…")
-        src = fetch_source(sid, sleep_s=sleep_s, mailto=mailto)
+        refresh_ui(force=not src_future.done())  # flush before blocking; the throttle has no trailing update
+        src = src_future.result()
         display_name = src.get("display_name", "")
         display_slug = safe_slug(display_name)
 
-        if show_progress_details:
+        if panel is not None:
             # Update expander header with display name for clarity
-            panels[sid]["title"] = display_name or sid
-            panels[sid]["exp"].markdown(
+            panel["title"] = display_name or sid
+            panel["exp"].markdown(
                 f"**Server:** {display_name or '(unknown)'}  \n"
                 f"**OpenAlex ID:** `{sid}`"
             )
@@ -858,69 +1054,61 @@ def build_zip_from_selection(
         flat["topics_display"] = topics_display
         flat["topics_subfields"] = topics_subfields
         flat["topics_domains"] = topics_domains
-        flat["raw_json"] = json.dumps(src, ensure_ascii=False)
 
         servers_rows.append(flat)
         all_columns.update(flat.keys())
         sid_to_name[flat["source_id"]] = display_name
+        raw_json_by_sid[flat["source_id"]] = _dumps_bytes(src)  # UTF-8 straight from the encoder
 
         # Yearly trends (fast)
-        cby = src.get("counts_by_year", []) or []
-        for row in cby:
+        for row in src.get("counts_by_year") or []:
             y = str(row.get("year", ""))
             if y.isdigit():
-                years_seen.add(y)
-                yearly_data.setdefault(flat["source_id"], {}).setdefault(y, {"works_count": 0, "cited_by_count": 0})
-                yearly_data[flat["source_id"]][y]["works_count"] = int(row.get("works_count", 0) or 0)
-                yearly_data[flat["source_id"]][y]["cited_by_count"] = int(row.get("cited_by_count", 0) or 0)
+                for metric in TREND_METRICS:
+                    year_records.append((flat["source_id"], metric, y, int(row.get(metric, 0) or 0)))
 
         # Monthly trends (optional & slow)
         if monthly_enabled:
             log_server(sid, "Monthly aggregation started… (this can take a while)")
+            # Aggregate page by page so memory scales with months, not with works
+            month_agg = monthly_counts_from_works([])
             works_processed = 0
-            for w in iter_works_for_source(
+            refresh_ui(force=True)  # the first Works page blocks on the API
+            for page in iter_works_for_source(
                 flat["source_id"], date_from or None, date_to or None,
                 sleep_s=sleep_s, mailto=mailto,
                 select_fields="publication_date,cited_by_count",
                 use_primary_location=use_primary_location, use_host_venue=use_host_venue
             ):
-                ym = iso_to_year_month(w.get("publication_date"))
-                if not ym:
-                    continue
-                months_seen.add(ym)
-                monthly_data.setdefault(flat["source_id"], {}).setdefault(ym, {"works_count": 0, "cited_by_count": 0})
-                monthly_data[flat["source_id"]][ym]["works_count"] += 1
-                monthly_data[flat["source_id"]][ym]["cited_by_count"] += int(w.get("cited_by_count", 0) or 0)
-                works_processed += 1
-                if works_processed % 500 == 0 and show_progress_details:
+                month_agg = month_agg.add(monthly_counts_from_works(page), fill_value=0)
+                before = works_processed
+                works_processed += len(page)
+                if works_processed // 500 > before // 500 and panel is not None:
                     log_server(sid, f"…processed {works_processed} works so far")
-                    if panels.get(sid, {}).get("progress") is not None:
-                        pct = min(99, (works_processed // 5) % 100) / 100.0
-                        panels[sid]["progress"].progress(pct)
-            if show_progress_details:
+                    panel["pct"] = min(99, (works_processed // 5) % 100) / 100.0
+                refresh_ui()
+            month_agg = month_agg.astype("int64")
+            for metric in TREND_METRICS:
+                month_records.extend(
+                    (flat["source_id"], metric, ym, value)
+                    for ym, value in zip(month_agg.index, month_agg[metric].tolist())
+                )
+            if panel is not None:
                 log_server(sid, f"Monthly aggregation complete. Total works scanned: {works_processed}")
-                if panels.get(sid, {}).get("progress") is not None:
-                    panels[sid]["progress"].progress(1.0)
+                panel["pct"] = 1.0
         else:
             log_server(sid, "Monthly aggregation skipped (disabled).")
 
         # Per-server timing + UI refresh
-        elapsed = time.time() - t0
-        per_server_times.append(elapsed)
+        elapsed = _now() - t0
+        time_total += elapsed
         done += 1
 
-        # Compact updates
-        push_compact(f"{done}/{total} — Done {display_name or sid} in {int(elapsed)}s")
-        if compact_status is not None:
-            compact_status.text(f"Servers processed: {done}/{total}")
-        if compact_progress is not None:
-            compact_progress.progress(done / total)
-
-        # Existing overall progress + metrics
-        if show_progress_details:
-            overall_prog.progress(done / total)
-        log_overall(f"Finished {display_name or sid} in {int(elapsed)}s")
-        update_metrics()
+        # Compact updates + overall progress/metrics (final refresh is never throttled)
+        push_compact(f"{done}/{total} — Done {display_name or sid} in {elapsed:.0f}s")
+        dirty.add("progress")
+        log_overall(f"Finished {display_name or sid} in {elapsed:.0f}s")
+        refresh_ui(force=(done == total))
 
     # ── Build the three CSVs as DataFrames ────────────────────────────────────
     preferred_first = [
@@ -933,81 +1121,82 @@ def build_zip_from_selection(
         "topics_display","topics_subfields","topics_domains",
         "works_api_url","updated_date","created_date"
     ]
-    remaining = sorted([c for c in all_columns if c not in preferred_first and c != "raw_json"])
-    servers_header = [c for c in preferred_first if c in all_columns] + remaining + ["raw_json"]
-    servers_df = pd.DataFrame([{col: row.get(col, "") for col in servers_header} for row in servers_rows])
+    preferred_set = frozenset(preferred_first)
+    remaining = sorted(c for c in all_columns if c not in preferred_set)
+    servers_header = [c for c in preferred_first if c in all_columns] + remaining
+    # Pad every row to the full header once, then pull values out per row in C and transpose
+    header_defaults = dict.fromkeys(servers_header, "")
+    row_values = operator.itemgetter(*servers_header)
+    servers_cols = zip(*(row_values({**header_defaults, **row}) for row in servers_rows))
+    servers_df = pd.DataFrame(dict(zip(servers_header, servers_cols)), columns=servers_header)
 
     # Yearly wide
-    years_sorted = sorted(years_seen, key=lambda x: int(x)) if years_seen else []
-    yearly_rows = []
-    for sid, year_map in yearly_data.items():
-        disp = sid_to_name.get(sid, "")
-        row_wc = {"source_id": sid, "display_name": disp, "metric": "works_count"}
-        row_cb = {"source_id": sid, "display_name": disp, "metric": "cited_by_count"}
-        for y in years_sorted:
-            row_wc[y] = year_map.get(y, {}).get("works_count", 0)
-            row_cb[y] = year_map.get(y, {}).get("cited_by_count", 0)
-        yearly_rows.append(row_wc); yearly_rows.append(row_cb)
-    yearly_df = pd.DataFrame(yearly_rows, columns=["source_id","display_name","metric"] + years_sorted)
-
-    # Monthly wide (or placeholder)
-    if monthly_enabled and months_seen:
-        months_sorted = sorted(months_seen)
-        monthly_rows = []
-        for sid, month_map in monthly_data.items():
-            disp = sid_to_name.get(sid, "")
-            row_wc = {"source_id": sid, "display_name": disp, "metric": "works_count"}
-            row_cb = {"source_id": sid, "display_name": disp, "metric": "cited_by_count"}
-            for m in months_sorted:
-                row_wc[m] = month_map.get(m, {}).get("works_count", 0)
-                row_cb[m] = month_map.get(m, {}).get("cited_by_count", 0)
-            monthly_rows.append(row_wc); monthly_rows.append(row_cb)
-        monthly_df = pd.DataFrame(monthly_rows, columns=["source_id","display_name","metric"] + months_sorted)
-    else:
-        monthly_df = pd.DataFrame([{
-            "source_id": "",
-            "display_name": "",
-            "metric": "info",
-            "note": "Monthly aggregation disabled in app."
-        }], columns=["source_id","display_name","metric","note"])
-
-    # ── Package everything into a single ZIP (in memory) ──────────────────────
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
-        # CSVs
-        zf.writestr("servers.csv", servers_df.to_csv(index=False))
-        zf.writestr("server_yearly_trends.csv", yearly_df.to_csv(index=False))
-        zf.writestr("server_monthly_trends.csv", monthly_df.to_csv(index=False))
-
-        # Raw JSON for sources (use display name + sid in filename)
-        for row in servers_rows:
-            sid = row.get("source_id", "unknown")
-            raw = row.get("raw_json", "{}")
-            disp = row.get("display_name", "")
-            slug = safe_slug(disp) if disp else "unknown"
-            zf.writestr(f"json/source_{slug}_{sid}.json", raw)
-
-        # Also include any previously previewed sample Work JSONs (optional, named with display+sid)
-        if include_preview_works_in_zip and preview_samples:
-            for sid, blobs in preview_samples.items():
-                sw = blobs.get("sample_work")
-                src = blobs.get("source", {})
-                disp = (src or {}).get("display_name", "")
+    yearly_df = wide_trends(year_records, sid_to_name)
+
+    # Monthly wide (or the constant placeholder; its preview frame is cached)
+    monthly_built = monthly_enabled and bool(month_records)
+    monthly_df = wide_trends(month_records, sid_to_name) if monthly_built else monthly_disabled_preview()
+
+    # ── Package everything into a single ZIP (spooled: memory, then disk) ─────
+    # CSVs are encoded on worker threads so encoding one overlaps DEFLATE of the previous
+    csv_pool = ThreadPoolExecutor(max_workers=3)
+    csv_tables = [("servers.csv", servers_df), ("server_yearly_trends.csv", yearly_df)]
+    if monthly_built:
+        csv_tables.append(("server_monthly_trends.csv", monthly_df))
+    csv_jobs = [(name, csv_pool.submit(encode_csv, df)) for name, df in csv_tables]
+    csv_pool.shutdown(wait=False)  # jobs keep running; results are collected below
+
+    # The spool is closed here even if packaging fails (it may already have spilled to disk)
+    with tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_MAX, buffering=ZIP_WRITE_BUFFER) as buf:
+        # Level 1 DEFLATE: far less CPU than the default (6) for a small size increase on text
+        with zipfile.ZipFile(
+            buf, mode="w", compression=zipfile.ZIP_DEFLATED, compresslevel=1, allowZip64=True
+        ) as zf:
+            # CSVs (stitched in sequentially as each encoding finishes)
+            for name, job in csv_jobs:
+                copy_file_to_zip(zf, name, job.result())
+            if not monthly_built:
+                zf.writestr("server_monthly_trends.csv", _MONTHLY_DISABLED_CSV, compress_type=zipfile.ZIP_STORED)
+
+            # Parquet twins of the CSVs (columnar + zstd: much smaller, typed, quick to load)
+            write_parquet_to_zip(
+                zf, "servers.parquet", servers_df,
+                use_dictionary=["source_id", "type", "country_code", "host_organization"],
+            )
+            write_parquet_to_zip(zf, "server_yearly_trends.parquet", yearly_df)
+            if monthly_built:
+                write_parquet_to_zip(zf, "server_monthly_trends.parquet", monthly_df)
+
+            # Raw JSON for sources (use display name + sid in filename); repeated keys deflate well
+            for row in servers_rows:
+                sid = row.get("source_id", "unknown")
+                raw = raw_json_by_sid.get(sid, b"{}")
+                disp = row.get("display_name", "")
                 slug = safe_slug(disp) if disp else "unknown"
-                if sw:
-                    zf.writestr(f"json/sample_work_{slug}_{sid}.json", to_pretty_json_str(sw))
-
-        # Selection summary
-        zf.writestr("json/selection_summary.json", json.dumps({
-            "selected_source_ids": chosen_sids,
-            "date_from": date_from,
-            "date_to": date_to,
-            "use_primary_location": use_primary_location,
-            "use_host_venue": use_host_venue,
-            "monthly_enabled": monthly_enabled
-        }, ensure_ascii=False, indent=2))
-    buf.seek(0)
-    return buf.read(), servers_df, yearly_df, monthly_df
+                write_blob_to_zip(zf, f"json/source_{slug}_{sid}.json", raw)
+
+            # Also include any previously previewed sample Work JSONs (optional, named with display+sid)
+            if include_preview_works_in_zip and preview_samples:
+                for sid, blobs in preview_samples.items():
+                    sw = blobs.get("sample_work")
+                    src = blobs.get("source")
+                    disp = (src or _EMPTY).get("display_name", "")
+                    slug = safe_slug(disp) if disp else "unknown"
+                    if sw:
+                        zf.writestr(f"json/sample_work_{slug}_{sid}.json", to_pretty_json_str(sw))
+
+            # Selection summary
+            zf.writestr("json/selection_summary.json", _dumps_bytes({
+                "selected_source_ids": chosen_sids,
+                "date_from": date_from,
+                "date_to": date_to,
+                "use_primary_location": use_primary_location,
+                "use_host_venue": use_host_venue,
+                "monthly_enabled": monthly_enabled
+            }, indent=True))
+        buf.seek(0)
+        zip_bytes = buf.read()
+    return zip_bytes, servers_df, yearly_df, monthly_df
 
 # ──────────────────────────────────────────────────────────────────────────────
 # STEP 3 UI: Compact progress + last-N log + run button + previews
@@ -1078,9 +1267,8 @@ if run_btn:
         st.success("✅ Build complete! Preview below and download your ZIP.")
 
         st.markdown("#### Preview: servers.csv")
-        st.write("Tip: `raw_json` is hidden in the preview for readability, but included in the ZIP.")
-        preview_servers = servers_df.drop(columns=[c for c in servers_df.columns if c == "raw_json"])
-        st.dataframe(preview_servers, use_container_width=True, height=300)
+        st.write("Tip: the raw JSON for each server is not a column here; it is in the ZIP's `json/` folder.")
+        st.dataframe(servers_df, use_container_width=True, height=300)
 
         st.markdown("#### Preview: server_yearly_trends.csv")
         st.dataframe(yearly_df, use_container_width=True, height=240)
@@ -1099,7 +1287,7 @@ if run_btn:
             data=zip_bytes,
             file_name=f"openalex_preprint_servers_results_{timestamp}.zip",
             mime="application/zip",
-            help="ZIP includes three CSVs and a json/ folder with raw records."
+            help="ZIP includes three CSVs (plus Parquet copies) and a json/ folder with raw records."
         )
     except Exception as e:
         st.error(f"Failed to build ZIP: {e}")